@@ -1,45 +1,189 @@
 
 # %%
 import streamlit as st
-import pyperclip
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+import urllib3
+from lxml import etree
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pacsv
 import io
+import re
+import xlsxwriter
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Copy-on-Write: slices, drops and shallow copies share data until a column is actually modified
+pd.set_option("mode.copy_on_write", True)
+
+# Anything that is not part of a number (footnote markers, currency signs, thousands separators, ...)
+_NUMERIC_RE = re.compile(r"[^\d\.\-]")
+
+# The leading digits of a rowspan/colspan attribute
+_SPAN_RE = re.compile(r"\s*(\d+)")
 
 # Functions
-def copy_to_clipboard(text):
+def table_to_array(table_html):
+    """
+    Parses an HTML table into a 2D array of cells using pandas.read_html with the lxml backend.
+    
+    read_html moves the leading header rows into the column labels, so they are put back
+    on top of the data rows to let the user choose which row holds the column names.
+    Cells keep the page's text as is ("007", "1,2", "True"); turning columns into numbers is left to Step 3.
+    
+    Parameters:
+    table_html (str): The HTML of the <table> element to parse.
+    
+    Returns:
+    np.ndarray: An object array with one row per table row. Cells spanning several rows or columns are
+    repeated and short rows are padded with empty strings, so the array is always rectangular.
+    """
     try:
-        pyperclip.copy(text)
-        st.success("Copied to clipboard!")
-    except pyperclip.PyperclipException as e:
-        st.warning("Clipboard functionality currently not supported. Copy the link address below...")
-        st.markdown(f"[Website]({text})", unsafe_allow_html=True)
+        parsed = pd.read_html(
+            io.StringIO(table_html),
+            flavor="lxml",
+            thousands=None,  # Don't strip commas, "1,2" is not 12
+            keep_default_na=False,  # Empty cells and "NA" stay text
+            converters=defaultdict(lambda: str),  # No type inference for any column
+        )
+    except ValueError as e:
+        if "No tables found" not in str(e):
+            raise
+        parsed = []
+    if not parsed:  # Table without any rows, e.g. only a caption
+        return np.empty((0, 0), dtype=object)
+    df = parsed[0]
+    
+    cells = df.to_numpy(dtype=object)
+    if not df.columns.equals(pd.RangeIndex(df.shape[1])):
+        header_rows = np.array([
+            ["" if str(label).startswith("Unnamed:") else label for label in df.columns.get_level_values(level)]
+            for level in range(df.columns.nlevels)
+        ], dtype=object)
+        cells = np.concatenate([header_rows, cells])
+    
+    return cells
+
+@st.cache_resource
+def _session():
+    """
+    Returns one requests.Session shared by all reruns and users, so repeated fetches
+    from Wikipedia reuse open (keep-alive) connections instead of a new TCP/TLS handshake each time.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    session.headers.update({"User-Agent": "WikiTableScraper/1.0", "Accept-Encoding": "gzip, deflate"})
+    return session
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def fetch_tables(url, tbl_class="wikitable"):
+    """
+    Downloads a web page and parses every table of the given HTML class.
+    The page is parsed while it streams in, and each table is dropped from the tree as soon as it is closed,
+    so the full document is never held in memory. Closed tables are converted by a thread pool
+    while the rest of the page is still downloading.
+    Cached per URL, so widget changes rerun the script without a new download and parse.
+    
+    Parameters:
+    url (str): The address of the page.
+    tbl_class (str): The HTML class of the tables to extract.
+    
+    Returns:
+    list: One array of cells per table found (see table_to_array).
+    """
+    futures = []
+    with ThreadPoolExecutor(max_workers=4) as executor, _session().get(url, timeout=10, stream=True) as page:
+        page.raise_for_status()
+        page.raw.decode_content = True  # Undo the gzip transfer encoding while streaming
+        # Without a charset in the header requests falls back to ISO-8859-1; let lxml read the page's <meta charset> instead
+        encoding = page.encoding if "charset" in page.headers.get("content-type", "").lower() else None
+        try:
+            for _, table in etree.iterparse(page.raw, tag="table", html=True, encoding=encoding):
+                # Match the class as a token, "wikitable sortable" is a wikitable too
+                if tbl_class in (table.get("class") or "").split():
+                    # Drop footnote markers like [1] or [a], otherwise the Step 3 cleanup turns "12.5[1]" into 12.51
+                    for ref in table.xpath('.//sup[contains(concat(" ", normalize-space(@class), " "), " reference ")]'):
+                        ref.tag = "footnote"
+                    etree.strip_elements(table, "footnote", with_tail=False)
+                    # Read spans like a browser does, read_html fails on values such as rowspan="2;"
+                    for attr in ("rowspan", "colspan"):
+                        for cell in table.xpath(f".//*[@{attr}]"):
+                            digits = _SPAN_RE.match(cell.get(attr))
+                            cell.set(attr, str(max(int(digits.group(1)), 1)) if digits else "1")
+                    table_html = etree.tostring(table, encoding="unicode", method="html")
+                    futures.append(executor.submit(table_to_array, table_html))
+                if next(table.iterancestors("table"), None) is None:  # Nested tables are still part of their outer table
+                    table.clear()
+                    while table.getprevious() is not None:  # Drop everything parsed before this table
+                        del table.getparent()[0]
+        except etree.XMLSyntaxError:  # Empty document
+            pass
+        except urllib3.exceptions.HTTPError as e:  # Reading page.raw bypasses requests' own exception wrapping
+            raise requests.ConnectionError(e) from e
+    
+    tables = [future.result() for future in futures]
+    return [cells for cells in tables if cells.size]
 
-def clean_numeric_columns(df, col_names):
+def show_example_link(text):
+    # Browsers only allow clipboard writes from a user's click, so let them copy it with st.code's copy button
+    st.info("Copy the link below and paste it into the box above.")
+    st.code(text, language=None)
+    st.markdown(f"[Website]({text})", unsafe_allow_html=True)
+
+def _to_numeric(values):
+    """
+    Converts a column to numbers. Columns that already parse as they are skip the cleanup regex,
+    otherwise it only runs on the cells that failed to parse (e.g. '1,234[a]').
+    
+    Parameters:
+    values (pd.Series): The column to convert.
+    
+    Returns:
+    pd.Series: The numeric column, with NaN where a cell has no number in it.
     """
-    Cleans the specified columns in the DataFrame by removing non-numeric characters
-    and converting them to numeric.
+    try:
+        return pd.to_numeric(values, errors='raise')
+    except (ValueError, TypeError):
+        pass
+    
+    numbers = pd.to_numeric(values, errors='coerce').astype("float64")
+    unparsed = numbers.isna() & values.notna()
+    repaired = pd.to_numeric(
+        values[unparsed]
+        .astype(str)
+        .str.replace(_NUMERIC_RE, "", regex=True),  # Remove non-numeric characters except '.' and '-'
+        errors='coerce'  # Convert to numeric, coercing errors to NaN
+    )
+    return numbers.fillna(repaired)
+
+@st.cache_data(show_spinner=False)
+def clean_numeric_columns(df, col_names, decimals, max_digits):
+    """
+    Cleans the specified columns in the DataFrame by removing non-numeric characters,
+    converting them to numeric, rounding them and replacing values that are too large with NaN.
+    Each column goes through all the steps at once instead of one pass over the table per step.
     
     Parameters:
     df (pd.DataFrame): The DataFrame to process.
-    col_names (list): A list of column names to clean.
+    col_names (tuple): The column names to clean.
+    decimals (int): The number of decimal places to round to.
+    max_digits (int): Values with more digits than this are replaced with NaN.
     
     Returns:
     pd.DataFrame: A DataFrame with the specified columns cleaned and converted to numeric.
     """
-    cleaned_df = df.copy()  # Avoid modifying the original DataFrame
+    cleaned_df = df.copy(deep=False)  # Avoid modifying the original DataFrame; with Copy-on-Write no data is copied here
+    thresh = 10.0**max_digits  # Computed once as a float: Arrow columns can't be compared with ints beyond int64
     
     for col in col_names:
-        if col in cleaned_df.columns:  # Ensure column exists
-            cleaned_df[col] = (
-                cleaned_df[col]
-                .astype(str)
-                .str.replace(r"[^\d\.\-]", "", regex=True)  # Remove non-numeric characters except '.' and '-'
-            )
-            cleaned_df[col] = pd.to_numeric(cleaned_df[col], errors='coerce')  # Convert to numeric, coercing errors to NaN
+        if col not in cleaned_df.columns:  # Ensure column exists
+            continue
+        values = _to_numeric(cleaned_df[col]).round(decimals)
+        cleaned_df[col] = values.mask(values.abs() > thresh)  # Replace values with more digits than allowed with NaN
     
     return cleaned_df
 
@@ -65,13 +209,13 @@ url = st.text_input("Enter a wikipedia URL", key="url")
 
 st.write("Examples")
 if st.button("US Economics"):
-    copy_to_clipboard(url1)
+    show_example_link(url1)
 
 if st.button("US Crime Rates"):
-    copy_to_clipboard(url2)
+    show_example_link(url2)
 
 if st.button("Top Grossing Films"):
-    copy_to_clipboard(url3)
+    show_example_link(url3)
 
 if not url:
     st.warning("⚠️ Please paste in a Wikipedia page link to proceed.")
@@ -79,9 +223,16 @@ if not url:
 
 # extract data (assumed to be class wikitable)
 tbl_class = "wikitable"
-page = requests.get(url)
-soup = BeautifulSoup(page.content, "html.parser")
-tables = soup.find_all("table", class_ = tbl_class)
+# st.cache_data hands back a fresh copy of every table on each rerun, so keep this session's tables
+# in session_state and only go through the cache when the URL changes
+if st.session_state.get("tables_url") != url:
+    try:
+        st.session_state.tables = fetch_tables(url, tbl_class)
+    except requests.RequestException:
+        st.warning("⚠️ Could not load the page. Please check the URL and try again.")
+        st.stop()
+    st.session_state.tables_url = url
+tables = st.session_state.tables
 table_count = f"Number of tables found: {len(tables)}"
 if (len(tables) == 0):
     st.warning("⚠️ Wikipedia page has no objects of HTML class 'wikitable'. Consider using a different page")
@@ -94,31 +245,18 @@ else:
 st.subheader("Step 2: Select Table and Dimensions")
 st.number_input("Enter which number table to extract", 1, len(tables), key = "idx")
 idx = st.session_state.idx-1 # table number of interest
-toi = tables[idx]
-
-# %%
-# Extract rows
-rows = []
-for tr in toi.find_all("tr"):
-    cells = tr.find_all(["td", "th"]) 
-    row = [cell.get_text(strip=True) for cell in cells]
-    rows.append(row)
+rows = tables[idx]
 
 use_headers = st.checkbox("Do you want to use the column names found in the data?", value=True)
 if use_headers:
     # User selects the row that contains headers
     which_header = st.number_input("Select the row header", 1, len(rows), key="which_header") - 1
-    headers = rows[which_header]
+    headers = list(rows[which_header])
     rows = rows[which_header+1:]
-
-    # Validate that the header and rows have consistent lengths
-    if not all(len(headers) == len(row) for row in rows):
-        st.warning("⚠️ Table cannot render. Please change the row with the column names.")
-        st.stop()  # Prevent further execution if the table is invalid
 else: 
     # User specifies the first row of data
     which_first_row = st.number_input("Select the number that has the first row of data", 1, len(rows), key="which_first_row") - 1
-    count_cols_needed = len(rows[which_first_row])
+    count_cols_needed = rows.shape[1]
 
     # Prompt the user to enter custom column names
     ch_lbl = f"Enter {count_cols_needed} column names separated by commas:"
@@ -139,13 +277,15 @@ else:
 # Get the columns to remove using multiselect
 cols_to_remove = st.multiselect("Select the column names to remove", headers)
 
-# Filter the DataFrame to keep only the selected columns
+# Wrap the rows without copying them, then filter the DataFrame to keep only the selected columns
+df = pd.DataFrame(rows, columns=headers, copy=False)
 if cols_to_remove:
-    df = pd.DataFrame(rows, columns=headers).drop(cols_to_remove, axis=1)  # Drop the specified columns
-else:
-    df = pd.DataFrame(rows, columns=headers)  # If no columns are selected, keep the whole DataFrame
+    df = df.drop(cols_to_remove, axis=1)  # Drop the specified columns
+# Every cell is text, so each column becomes string[pyarrow]: one contiguous buffer instead of a Python object per cell
+df = df.convert_dtypes(dtype_backend="pyarrow")
 
-df.columns = [f'{col}_{i}' if df.columns.tolist().count(col) > 1 else col for i, col in enumerate(df.columns)]
+col_counts = Counter(df.columns)
+df.columns = [f'{col}_{i}' if col_counts[col] > 1 else col for i, col in enumerate(df.columns)]
 rows_to_keep = st.slider("Select the range of rows to keep", 1, len(df), (1, len(df)))
 df = df.iloc[rows_to_keep[0]-1:rows_to_keep[1]]
 
@@ -164,58 +304,71 @@ else:
 
 if selected_columns:
     r_err = st.number_input("Enter rounding error decimal places", min_value=0, value=0)
-    thresh_err = st.number_input("Enter max number of digits", value = 16)
-    df2 = clean_numeric_columns(df, col_names=selected_columns)
-    numeric_cols = df2.select_dtypes(include=['number']).columns
-    df2[numeric_cols] = df2[numeric_cols].round(r_err)
-
-    # Apply check to identify and replace large integers with NaN
-    for col in numeric_cols:
-        df2[col] = df2[col].apply(lambda x: pd.NA if isinstance(x, (int, float)) and abs(x) > 10**thresh_err else x)
+    thresh_err = st.number_input("Enter max number of digits", max_value=308, value = 16)  # 10.0**309 overflows
+    df2 = clean_numeric_columns(df, col_names=tuple(selected_columns), decimals=r_err, max_digits=thresh_err)
 
 else: 
     df2 = df
 
-## Step 4: Using the data editor
-st.subheader("Step 4: Fix Remaining Cells")
-st.write("Edit a value by double-clicking the cell") 
-df3 = st.data_editor(df2)
-st.write("Note: Some cells may require specific edits. Thousands-separator commas are native to Streamlit and do not affect final output.")
-
-### Step 5: Download data file
-st.subheader("Step 5: Download the Data")
-userfilename = st.text_input("Enter in the desired name of your file", value="my_wikitable")
-
-# CSV
+# Download converters
 @st.cache_data
 def convert_csv(df):
-    return df.to_csv(index=False).encode('utf-8')
-
-csv = convert_csv(df3)
-
-if st.download_button(
-    label="Download data as CSV",
-    data=csv,
-    file_name=f'{userfilename}.csv',
-    mime='text/csv',
-):
-    st.success("Downloaded CSV file successfully!")
-
+    # Write straight from Arrow buffers to UTF-8 bytes instead of formatting every value into one big Python string
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (ValueError, pa.ArrowTypeError):  # Columns mixing text and numbers have no Arrow type, and duplicate names are rejected
+        return df.to_csv(index=False).encode('utf-8')
+    buffer = pa.BufferOutputStream()
+    pacsv.write_csv(table, buffer)
+    return buffer.getvalue().to_pybytes()
 
-# EXCEL
 @st.cache_data
 def convert_xlsx(df):
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name='Sheet1', index=False)
+    # Stream the sheet row by row; constant_memory flushes each row instead of keeping every cell in memory
+    # Dates get the same format DataFrame.to_excel uses instead of showing up as bare serial numbers
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    worksheet = workbook.add_worksheet('Sheet1')
+    worksheet.write_row(0, 0, [str(col) for col in df.columns])
+    cells = df.to_numpy(dtype=object)
+    cells[pd.isna(cells)] = None  # Missing values become empty cells
+    cells[cells == np.inf] = 'inf'  # Excel has no infinity, write it as text like to_excel does
+    cells[cells == -np.inf] = '-inf'
+    for i, row in enumerate(cells.tolist(), start=1):
+        worksheet.write_row(i, 0, row)
+    workbook.close()
     return output.getvalue()
 
-xlsx = convert_xlsx(df3)
-
-if st.download_button(
-    label="Download data as Excel",
-    data=xlsx,
-    file_name=f'{userfilename}.xlsx',
-    mime='application/vnd.ms-excel',
-):
-    st.success("Downloaded Excel file successfully!")
+# Steps 4 and 5 run as a fragment: editing a cell or the file name only reruns this part of the page,
+# not the fetch, table selection and numeric cleanup above
+@st.fragment
+def edit_and_download(df2, default_filename="my_wikitable"):
+    ## Step 4: Using the data editor
+    st.subheader("Step 4: Fix Remaining Cells")
+    st.write("Edit a value by double-clicking the cell") 
+    df3 = st.data_editor(df2)
+    st.write("Note: Some cells may require specific edits. Thousands-separator commas are native to Streamlit and do not affect final output.")
+
+    ### Step 5: Download data file
+    st.subheader("Step 5: Download the Data")
+    userfilename = st.text_input("Enter in the desired name of your file", value=default_filename)
+
+    # CSV
+    if st.download_button(
+        label="Download data as CSV",
+        data=lambda: convert_csv(df3),  # Deferred: only serialized when the button is clicked
+        file_name=f'{userfilename}.csv',
+        mime='text/csv',
+    ):
+        st.success("Downloaded CSV file successfully!")
+
+    # EXCEL
+    if st.download_button(
+        label="Download data as Excel",
+        data=lambda: convert_xlsx(df3),  # Deferred: only serialized when the button is clicked
+        file_name=f'{userfilename}.xlsx',
+        mime='application/vnd.ms-excel',
+    ):
+        st.success("Downloaded Excel file successfully!")
+
+edit_and_download(df2)